@@ -1,77 +1,101 @@
 import serial
 import pygame
+import atexit
+import logging
+import logging.handlers
 import os
+import queue
+import sys
 import time
 import threading
 
-pygame.mixer.init()
-pygame.mixer.set_num_channels(16)  # Increase available channels
+log = logging.getLogger("bottle")
+log.setLevel(logging.INFO)
+log.propagate = False
+# Hot paths only enqueue records; the listener thread does the stdout writes
+log_queue = queue.Queue(-1)
+log.addHandler(logging.handlers.QueueHandler(log_queue))
+log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+log_listener.start()
+atexit.register(log_listener.stop)
 
 SEQUENCE_CMD = 'PLAYBACK (Sequence):'
 CHORD_CMD = 'CMD:CHORD:'
 PLAY_DURATION_NOTE = 1  # in seconds (length of each note)
 PLAY_DURATION_CHORD = 10  # in seconds (length of each chord)
 FADE_DURATION = 100  # in milliseconds (fade out time)
+SOUNDS_DIR = "Sounds"
 
-# Reserve channels: 0-7 for sequences, 8-15 for chords
-SEQUENCE_CHANNELS = list(range(0, 8))
-CHORD_CHANNELS = list(range(8, 16))
+CHANNEL_GROWTH = 4  # Extra channels to allocate when chords run out
 
 sequence_recordings = []
 chord_recordings = []
-stop_playback = False
+stop_event = threading.Event()
 sequence_thread = None
 chord_thread = None
 
 
+# Note name -> WAV path, filled in once the mixer starts
+NOTE_FILES = {}
+# Decoded chord sounds, loaded on first use
+SOUND_CACHE = {}
+
+
+def _ensure_mixer():
+    # The mixer runs its own audio thread, so only start it once there is something to play
+    if pygame.mixer.get_init():
+        return
+    pygame.mixer.init()
+    pygame.mixer.set_num_channels(16)  # Increase available channels
+
+    for filename in os.listdir(SOUNDS_DIR):
+        if filename.endswith(".wav"):
+            NOTE_FILES[os.path.splitext(filename)[0]] = os.path.join(SOUNDS_DIR, filename)
+
+
 def play_sound_file(note):
-    filename = f"{note}.wav"
-    filepath = os.path.join("Sounds", filename)
-    if os.path.exists(filepath):
-        return pygame.mixer.Sound(filepath)
-    return None
+    # Chords need simultaneous channels, so decode each note once and reuse it
+    if note not in SOUND_CACHE and note in NOTE_FILES:
+        SOUND_CACHE[note] = pygame.mixer.Sound(NOTE_FILES[note])
+    return SOUND_CACHE.get(note)
 
 
 def sleep_interruptible(duration_sec):
-    for _ in range(int(duration_sec * 10)):
-        if stop_playback:
-            return True
-        time.sleep(0.1)
-    return False
+    return stop_event.wait(duration_sec)
 
 
 def play_sequence(notes):
-    global stop_playback
-
-    print(f"  Sequential: {notes}")
-    channel = pygame.mixer.Channel(SEQUENCE_CHANNELS[0])
+    # One note at a time, so stream through mixer.music instead of decoding into RAM
+    log.info(f"  Sequential: {notes}")
 
     for note in notes:
-        if stop_playback:
+        if stop_event.is_set():
             return
 
-        sound = play_sound_file(note)
-        if sound:
-            channel.play(sound)
-            print(f"    Playing {note}")
+        filepath = NOTE_FILES.get(note)
+        if filepath:
+            pygame.mixer.music.load(filepath)
+            pygame.mixer.music.play()
+            log.info(f"    Playing {note}")
 
             if sleep_interruptible(PLAY_DURATION_NOTE):
                 return
-            channel.stop()
+            pygame.mixer.music.stop()
             time.sleep(0.05)  # Small gap between notes
 
 
 def play_chord(notes):
-    global stop_playback
-
-    print(f"  Chord (simultaneous): {notes}")
+    log.info(f"  Chord (simultaneous): {notes}")
     channels = []
-    for i, note in enumerate(notes):
-        if i < len(CHORD_CHANNELS):
-            channel = pygame.mixer.Channel(CHORD_CHANNELS[i])
-            sound = play_sound_file(note)
-            if sound:
-                channel.play(sound)
+    for note in notes:
+        sound = play_sound_file(note)
+        if sound:
+            channel = sound.play()
+            if channel is None:
+                # Every channel is busy, grow the pool and retry
+                pygame.mixer.set_num_channels(pygame.mixer.get_num_channels() + CHANNEL_GROWTH)
+                channel = sound.play()
+            if channel:
                 channels.append(channel)
 
     if sleep_interruptible(PLAY_DURATION_CHORD):
@@ -83,49 +107,48 @@ def play_chord(notes):
 
 
 def play_all_sequences():
-    global stop_playback
-
-    while not stop_playback:
+    while not stop_event.is_set():
         for i, notes in enumerate(sequence_recordings):
-            if stop_playback:
+            if stop_event.is_set():
                 return
-            print(f"Playing sequence {i+1}/{len(sequence_recordings)}")
+            log.info(f"Playing sequence {i+1}/{len(sequence_recordings)}")
             play_sequence(notes)
 
 
 def play_all_chords():
-    global stop_playback
-
-    while not stop_playback:
+    while not stop_event.is_set():
         for i, notes in enumerate(chord_recordings):
-            if stop_playback:
+            if stop_event.is_set():
                 return
-            print(f"Playing chord {i+1}/{len(chord_recordings)}")
+            log.info(f"Playing chord {i+1}/{len(chord_recordings)}")
             play_chord(notes)
 
 
 def handle_new_recording(notes, is_chord):
-    global stop_playback, sequence_thread, chord_thread
+    global sequence_thread, chord_thread
+
+    _ensure_mixer()
 
     # Stop existing playback
-    stop_playback = True
+    stop_event.set()
     if sequence_thread and sequence_thread.is_alive():
         sequence_thread.join()
     if chord_thread and chord_thread.is_alive():
         chord_thread.join()
     pygame.mixer.fadeout(FADE_DURATION)
+    pygame.mixer.music.fadeout(FADE_DURATION)
     time.sleep(FADE_DURATION / 1000)
 
     # Add new recording
     if is_chord:
         chord_recordings.append(notes)
-        print(f"Added chord recording. Total: {len(sequence_recordings)} sequences, {len(chord_recordings)} chords")
+        log.info(f"Added chord recording. Total: {len(sequence_recordings)} sequences, {len(chord_recordings)} chords")
     else:
         sequence_recordings.append(notes)
-        print(f"Added sequence recording. Total: {len(sequence_recordings)} sequences, {len(chord_recordings)} chords")
+        log.info(f"Added sequence recording. Total: {len(sequence_recordings)} sequences, {len(chord_recordings)} chords")
 
     # Restart both threads
-    stop_playback = False
+    stop_event.clear()
     if len(sequence_recordings) > 0:
         sequence_thread = threading.Thread(target=play_all_sequences)
         sequence_thread.start()
@@ -134,24 +157,36 @@ def handle_new_recording(notes, is_chord):
         chord_thread.start()
 
 
+def handle_command(command):
+    log.info(f"\nReceived: {command}")
+
+    if command.startswith(SEQUENCE_CMD):
+        notes = command.split(":")[1].strip().split()
+        handle_new_recording(notes, is_chord=False)
+    elif command.startswith(CHORD_CMD):
+        # Parse chord format: "CMD:CHORD:B,D,G,"
+        notes_str = command.split(":", 2)[2].strip()
+        notes = [n for n in notes_str.split(",") if n]  # Remove empty strings
+        handle_new_recording(notes, is_chord=True)
 
-# Arduino setup
-ser = serial.Serial('/dev/cu.usbmodem1301', 9600)  # '/dev/cu.usbmodem1101' for Mac and 'COM5' for 'COM3' for Windows
-print("Listening for audio commands from Arduino...")
 
+
+# Arduino setup
+ser = serial.Serial('/dev/cu.usbmodem1301', 9600, timeout=None)  # '/dev/cu.usbmodem1101' for Mac and 'COM5' for 'COM3' for Windows
+try:
+    ser.set_low_latency_mode(True)  # Skip the USB-serial latency timer (Linux only)
+except (AttributeError, NotImplementedError, ValueError, OSError):
+    pass
+ser.reset_input_buffer()  # Drop stale bytes from before we started listening
+log.info("Listening for audio commands from Arduino...")
+
+buffer = bytearray()
 while True:
-    if ser.in_waiting > 0:
-        command = ser.readline().decode('utf-8').strip()
-        print(f"\nReceived: {command}")
-
-        if command.startswith(SEQUENCE_CMD):
-            notes = command.split(":")[1].strip().split()
-            handle_new_recording(notes, is_chord=False)
-        elif command.startswith(CHORD_CMD):
-            # Parse chord format: "CMD:CHORD:B,D,G,"
-            notes_str = command.split(":", 2)[2].strip()
-            notes = [n for n in notes_str.split(",") if n]  # Remove empty strings
-            handle_new_recording(notes, is_chord=True)
+    # Block for the first byte, then drain whatever else has arrived in one read
+    buffer += ser.read(ser.in_waiting or 1)
+    *lines, buffer = buffer.split(b'\n')
+    for line in lines:
+        handle_command(line.decode('utf-8').strip())
 
 
 
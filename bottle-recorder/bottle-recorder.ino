@@ -32,6 +32,15 @@
 #define POT_MIDPOINT 2048  // ESP32 12-bit ADC midpoint (0-4095)
 #define SELECTING_TIMEOUT 5000  // Time before returning to IDLE
 #define LED_UPDATE_INTERVAL 100  // LED update rate during recording
+#define LED_COLOR_UNKNOWN 0xFFFFFFFF  // Never produced by strip.Color()
+#define PULSE_STEPS 64  // Entries in the brightness lookup table
+#define INCOMPLETE_PULSE_PERIOD 1257  // ms per yellow pulse (2*PI*200)
+#define TRANSFER_PULSE_PERIOD 1885  // ms per cyan pulse (2*PI*300)
+
+// SD card files
+#define AUDIO_FILE "/audio.wav"
+#define COLOR_FILE "/color.dat"
+#define STATUS_FILE "/recordings.txt"
 
 // Test Mode - Set to true to enable serial command simulation
 #define TEST_MODE false  // Set to false to use real sensors
@@ -68,6 +77,9 @@ SensorType selectedSensor = AUDIO;
 bool hasAudio = false;
 bool hasColor = false;
 int wifiFailCount = 0;
+uint32_t shownLEDColor = LED_COLOR_UNKNOWN;  // Last color updateLEDs() drew
+uint8_t pulseLUT[PULSE_STEPS];  // One sine period of brightness, 0-254
+int savedStatus = -1;  // Flags last written to STATUS_FILE, -1 if not written yet
 
 // Timing Variables
 unsigned long lastPotRead = 0;
@@ -87,6 +99,11 @@ bool stableTilt = false;
 void setup() {
   Serial.begin(115200);
 
+  // Precompute the pulse curve so LED updates don't call sin()
+  for (int i = 0; i < PULSE_STEPS; i++) {
+    pulseLUT[i] = (sin(2.0 * PI * i / PULSE_STEPS) + 1) * 127;
+  }
+
   // Initialize pins
   pinMode(BUTTON_PIN, INPUT_PULLUP);
   pinMode(TILT_PIN, INPUT_PULLUP);
@@ -134,9 +151,9 @@ void setup() {
 
   // Clear old recordings on startup (for testing)
   Serial.println("Clearing old recordings...");
-  SD.remove("/audio.wav");
-  SD.remove("/color.dat");
-  SD.remove("/recordings.txt");
+  SD.remove(AUDIO_FILE);
+  SD.remove(COLOR_FILE);
+  SD.remove(STATUS_FILE);
   hasAudio = false;
   hasColor = false;
   Serial.println("Memory cleared - starting fresh");
@@ -420,8 +437,8 @@ void startRecording() {
 }
 
 void recordAudio() {
-  SD.remove("/audio.wav");
-  File audioFile = SD.open("/audio.wav", FILE_WRITE);
+  SD.remove(AUDIO_FILE);
+  File audioFile = SD.open(AUDIO_FILE, FILE_WRITE);
 
   if (!audioFile) {
     enterErrorState();
@@ -490,6 +507,7 @@ void recordAudio() {
   strip.fill(strip.Color(0, 0, 255));
   strip.show();
   delay(500);
+  invalidateLEDs();
 
   // Update WAV header with actual size
   audioFile.seek(0);
@@ -548,9 +566,10 @@ void captureColor() {
   strip.fill(strip.Color(red, green, blue));
   strip.show();
   delay(500);
+  invalidateLEDs();
 
   // Save to SD card
-  File colorFile = SD.open("/color.dat", FILE_WRITE);
+  File colorFile = SD.open(COLOR_FILE, FILE_WRITE);
   if (!colorFile) {
     Serial.println("Failed to save color data");
     enterErrorState();
@@ -584,7 +603,7 @@ void transferData() {
 
   // Read color data
   String colorString = "128,128,128";  // Default gray
-  File colorFile = SD.open("/color.dat", FILE_READ);
+  File colorFile = SD.open(COLOR_FILE, FILE_READ);
   if (colorFile) {
     if (colorFile.available()) {
       colorString = colorFile.readString();
@@ -598,7 +617,7 @@ void transferData() {
   }
 
   // Open audio file
-  File audioFile = SD.open("/audio.wav", FILE_READ);
+  File audioFile = SD.open(AUDIO_FILE, FILE_READ);
   if (!audioFile) {
     Serial.println("Failed to open audio file");
     handleTransferFailure();
@@ -621,7 +640,7 @@ void transferData() {
   audioFile.close();
 
   // Handle response
-  if (httpCode == 200) {
+  if (httpCode == 200 || httpCode == 202) {  // 202: server queued playback
     Serial.println("Transfer successful!");
     wifiFailCount = 0;
     clearMemory();
@@ -652,6 +671,7 @@ void handleTransferFailure() {
     strip.show();
     delay(200);
   }
+  invalidateLEDs();
 
   if (wifiFailCount >= 3) {
     Serial.println("3 transfer failures, clearing memory and resetting to IDLE");
@@ -665,8 +685,8 @@ void handleTransferFailure() {
 }
 
 void clearMemory() {
-  SD.remove("/audio.wav");
-  SD.remove("/color.dat");
+  SD.remove(AUDIO_FILE);
+  SD.remove(COLOR_FILE);
   hasAudio = false;
   hasColor = false;
   saveRecordingStatus();
@@ -674,7 +694,7 @@ void clearMemory() {
 }
 
 void loadRecordingStatus() {
-  File statusFile = SD.open("/recordings.txt", FILE_READ);
+  File statusFile = SD.open(STATUS_FILE, FILE_READ);
   if (statusFile) {
     String line = statusFile.readStringUntil('\n');
     // Format: audio:1,color:1
@@ -700,32 +720,39 @@ void loadRecordingStatus() {
 }
 
 void saveRecordingStatus() {
-  SD.remove("/recordings.txt");
-  File statusFile = SD.open("/recordings.txt", FILE_WRITE);
+  // Skip the SD rewrite when the flags haven't changed since the last save
+  int status = (hasAudio ? 2 : 0) | (hasColor ? 1 : 0);
+  if (status == savedStatus) {
+    return;
+  }
+
+  SD.remove(STATUS_FILE);
+  File statusFile = SD.open(STATUS_FILE, FILE_WRITE);
   if (statusFile) {
     statusFile.print("audio:");
     statusFile.print(hasAudio ? "1" : "0");
     statusFile.print(",color:");
     statusFile.println(hasColor ? "1" : "0");
     statusFile.close();
+    savedStatus = status;
   }
 }
 
 void updateLEDs(State state, int progress) {
-  strip.clear();
+  uint32_t color = 0;  // Off
 
   switch (state) {
     case IDLE:
       // Dim white
-      strip.fill(strip.Color(10, 10, 10));
+      color = strip.Color(10, 10, 10);
       break;
 
     case SELECTING:
       // Blue for mic, red for color
       if (selectedSensor == AUDIO) {
-        strip.fill(strip.Color(0, 0, 255));
+        color = strip.Color(0, 0, 255);
       } else {
-        strip.fill(strip.Color(255, 0, 0));
+        color = strip.Color(255, 0, 0);
       }
       break;
 
@@ -743,9 +770,9 @@ void updateLEDs(State state, int progress) {
         int brightness = 5 + (curve * 250);
 
         if (selectedSensor == AUDIO) {
-          strip.fill(strip.Color(0, 0, brightness));  // Blue for audio, increasing brightness
+          color = strip.Color(0, 0, brightness);  // Blue for audio, increasing brightness
         } else {
-          strip.fill(strip.Color(brightness, 0, 0));  // Red for color, increasing brightness
+          color = strip.Color(brightness, 0, 0);  // Red for color, increasing brightness
         }
       }
       break;
@@ -753,35 +780,51 @@ void updateLEDs(State state, int progress) {
     case INCOMPLETE:
       // Yellow pulse
       {
-        int brightness = (sin(millis() / 200.0) + 1) * 127;
-        strip.fill(strip.Color(brightness, brightness, 0));
+        int brightness = pulseBrightness(INCOMPLETE_PULSE_PERIOD);
+        color = strip.Color(brightness, brightness, 0);
       }
       break;
 
     case READY:
       // Solid green
-      strip.fill(strip.Color(0, 255, 0));
+      color = strip.Color(0, 255, 0);
       break;
 
     case TRANSFERRING:
       // Pulsing cyan
       {
-        int brightness = (sin(millis() / 300.0) + 1) * 127;
-        strip.fill(strip.Color(0, brightness, brightness));
+        int brightness = pulseBrightness(TRANSFER_PULSE_PERIOD);
+        color = strip.Color(0, brightness, brightness);
       }
       break;
 
     case ERROR_STATE:
       // Red blink
       if ((millis() / 500) % 2 == 0) {
-        strip.fill(strip.Color(255, 0, 0));
+        color = strip.Color(255, 0, 0);
       }
       break;
   }
 
+  // loop() calls this on every pass; only push to the strip when the color changes
+  if (color == shownLEDColor) {
+    return;
+  }
+  shownLEDColor = color;
+
+  strip.fill(color);
   strip.show();
 }
 
+int pulseBrightness(unsigned long periodMs) {
+  return pulseLUT[(millis() % periodMs) * PULSE_STEPS / periodMs];
+}
+
+void invalidateLEDs() {
+  // Call after drawing to the strip directly so the next updateLEDs() redraws
+  shownLEDColor = LED_COLOR_UNKNOWN;
+}
+
 void showIncompletePourWarning() {
   // Show 3 yellow blinks
   for (int i = 0; i < 3; i++) {
@@ -792,6 +835,7 @@ void showIncompletePourWarning() {
     strip.show();
     delay(200);
   }
+  invalidateLEDs();
   Serial.println("Incomplete pour attempt - need both recordings");
 }
 
@@ -808,35 +852,42 @@ void enterErrorState() {
     strip.show();
     delay(150);
   }
+  invalidateLEDs();
 }
 
 void writeWAVHeader(File &file, unsigned long dataSize) {
-  // RIFF header
-  file.print("RIFF");
+  // Build the 44-byte header in RAM and write it in one call
+  // (every SD write has fixed overhead, so 13 tiny writes add up)
+  uint8_t header[44];
   unsigned long chunkSize = dataSize + 36;
-  file.write((byte*)&chunkSize, 4);
-  file.print("WAVE");
-
-  // fmt subchunk
-  file.print("fmt ");
   unsigned long subchunk1Size = 16;
-  file.write((byte*)&subchunk1Size, 4);
   unsigned short audioFormat = 1;  // PCM
-  file.write((byte*)&audioFormat, 2);
   unsigned short numChannels = 1;  // Mono
-  file.write((byte*)&numChannels, 2);
   unsigned long sampleRate = SAMPLE_RATE;
-  file.write((byte*)&sampleRate, 4);
   unsigned long byteRate = SAMPLE_RATE * 2;  // 16-bit samples
-  file.write((byte*)&byteRate, 4);
   unsigned short blockAlign = 2;
-  file.write((byte*)&blockAlign, 2);
   unsigned short bitsPerSample = 16;
-  file.write((byte*)&bitsPerSample, 2);
+
+  // RIFF header
+  memcpy(header, "RIFF", 4);
+  memcpy(header + 4, &chunkSize, 4);
+  memcpy(header + 8, "WAVE", 4);
+
+  // fmt subchunk
+  memcpy(header + 12, "fmt ", 4);
+  memcpy(header + 16, &subchunk1Size, 4);
+  memcpy(header + 20, &audioFormat, 2);
+  memcpy(header + 22, &numChannels, 2);
+  memcpy(header + 24, &sampleRate, 4);
+  memcpy(header + 28, &byteRate, 4);
+  memcpy(header + 32, &blockAlign, 2);
+  memcpy(header + 34, &bitsPerSample, 2);
 
   // data subchunk
-  file.print("data");
-  file.write((byte*)&dataSize, 4);
+  memcpy(header + 36, "data", 4);
+  memcpy(header + 40, &dataSize, 4);
+
+  file.write(header, sizeof(header));
 }
 
 // ============================================================================
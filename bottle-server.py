@@ -4,139 +4,348 @@ Receives audio/color from ESP32, plays audio on laptop, displays color on UNO R4
 """
 
 from flask import Flask, request, jsonify
+from waitress import serve
 import serial
 import serial.tools.list_ports
+import atexit
+import functools
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import shutil
+import sys
+import tempfile
 import time
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pygame
 
 app = Flask(__name__)
 
+log = logging.getLogger("bottle")
+log.setLevel(logging.INFO)
+log.propagate = False
+# Hot paths only enqueue records; the listener thread does the stdout writes
+log_queue = queue.Queue(-1)
+log.addHandler(logging.handlers.QueueHandler(log_queue))
+log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+log_listener.start()
+atexit.register(log_listener.stop)
+
 # Configuration
 UPLOAD_FOLDER = Path('uploads')
 UPLOAD_FOLDER.mkdir(exist_ok=True)
 BAUD_RATE = 115200
 COLOR_REQUEST_TIMEOUT = 5  # seconds
-ARDUINO_RESET_DELAY = 2  # seconds
+SERIAL_READ_TIMEOUT = 0.01  # seconds
+SERIAL_WRITE_TIMEOUT = 0.1  # seconds
 DEFAULT_COLOR = "128,128,128"  # gray
 SAMPLE_RATE = 16000
+MIXER_BUFFER = 1024  # samples (smaller = less latency, larger = fewer underruns)
+PLAYBACK_CHANNEL = 0
+SOUND_CACHE_SIZE = 1  # only the current audio.wav is worth keeping decoded
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # bytes
+ARDUINO_PORT_CACHE = UPLOAD_FOLDER / '.arduino_port'
+# Built once so request handlers don't rebuild Path objects
+AUDIO_PATH = str((UPLOAD_FOLDER / 'audio.wav').resolve())
+COLOR_PATH = str((UPLOAD_FOLDER / 'color.dat').resolve())
+_BAR = "=" * 40  # Banner rule for request logs
+ARDUINO_VID = 0x2341  # Arduino SA USB vendor ID
+_PORT_RE = re.compile(r'Arduino|usbmodem')
+_COLOR_RE = re.compile(r'\d{1,3},\d{1,3},\d{1,3}')  # "R,G,B" as sent by the ESP32
+
+# Open the audio device once at startup so the first memory plays without an init stall
+pygame.mixer.pre_init(frequency=SAMPLE_RATE, size=-16, channels=1, buffer=MIXER_BUFFER)
+pygame.mixer.init()
+
+# One worker so memories play back in the order they arrived (each upload has its own file)
+playback_executor = ThreadPoolExecutor(max_workers=1)
 
 arduino_serial = None
+arduino_open = False  # Tracked here so /status doesn't have to probe the port
+arduino_lock = threading.Lock()  # Serializes all I/O on arduino_serial
+_CMD_CACHE = {}  # Command -> encoded line, the command set is tiny and fixed
 
 
 def find_arduino_port():
     """Auto-detect Arduino UNO R4"""
-    ports = serial.tools.list_ports.comports()
-    for port in ports:
-        if 'Arduino' in port.description or 'USB' in port.description or 'usbmodem' in port.device:
+    for port in serial.tools.list_ports.comports():
+        if port.vid == ARDUINO_VID or _PORT_RE.search(f"{port.device} {port.description}"):
             return port.device
     return None
 
 
+def read_cached_port():
+    """Port from the last successful connect, if any"""
+    try:
+        return ARDUINO_PORT_CACHE.read_text().strip() or None
+    except OSError:
+        return None
+
+
+def enable_low_latency(ser):
+    """Ask the driver to skip the USB-serial latency timer (Linux only)"""
+    try:
+        ser.set_low_latency_mode(True)
+    except (AttributeError, NotImplementedError, ValueError, OSError):
+        pass
+
+    # FTDI-style adapters also expose the timer in sysfs (default 16ms)
+    latency_timer = Path('/sys/bus/usb-serial/devices') / Path(ser.port).name / 'latency_timer'
+    try:
+        latency_timer.write_text('1')
+    except OSError:
+        pass
+
+
+def open_arduino(port):
+    """Open the port without resetting the board"""
+    ser = serial.Serial()
+    ser.port = port
+    ser.baudrate = BAUD_RATE
+    ser.timeout = SERIAL_READ_TIMEOUT
+    ser.write_timeout = SERIAL_WRITE_TIMEOUT
+    ser.xonxoff = False
+    ser.rtscts = False
+    # Leave DTR/RTS low so opening the port doesn't reset the board; with no
+    # reset there is no boot banner to wait for, so the port is usable at once
+    ser.dtr = False
+    ser.rts = False
+    ser.open()
+    enable_low_latency(ser)
+    return ser
+
+
 def connect_to_arduino():
     """Connect to Arduino UNO R4"""
-    global arduino_serial
+    global arduino_serial, arduino_open
+
+    # Try the last known port first to skip the comports() scan
+    cached_port = read_cached_port()
+    if cached_port:
+        try:
+            arduino_serial = open_arduino(cached_port)
+            arduino_open = True
+            log.info(f"✓ Connected to UNO R4 on {cached_port}")
+            return True
+        except serial.SerialException:
+            pass
+
     port = find_arduino_port()
 
     if port:
         try:
-            arduino_serial = serial.Serial(port, BAUD_RATE, timeout=1)
-            time.sleep(ARDUINO_RESET_DELAY)
-            print(f"✓ Connected to UNO R4 on {port}")
-            return True
+            arduino_serial = open_arduino(port)
+            arduino_open = True
+            log.info(f"✓ Connected to UNO R4 on {port}")
         except Exception as e:
-            print(f"✗ Failed to connect: {e}")
+            log.error(f"✗ Failed to connect: {e}")
+            return False
+        try:
+            ARDUINO_PORT_CACHE.write_text(port)
+        except OSError:
+            pass  # The cache only speeds up the next connect
+        return True
     else:
-        print("⚠ No UNO R4 found (LEDs disabled)")
+        log.warning("⚠ No UNO R4 found (LEDs disabled)")
     return False
 
 
+def close_arduino():
+    """Drop a stale port so the next command reopens it"""
+    global arduino_serial, arduino_open
+    if arduino_serial is not None:
+        try:
+            arduino_serial.close()
+        except (serial.SerialException, OSError):
+            pass
+    arduino_serial = None
+    arduino_open = False
+
+
 def send_command_to_arduino(command):
     """Send command to Arduino, reconnecting if needed"""
-    global arduino_serial
-    if not arduino_serial or not arduino_serial.is_open:
-        if not connect_to_arduino():
-            return False
+    global arduino_open
+    with arduino_lock:
+        # Reopen after a failed write or handshake too (e.g. board replugged);
+        # opening no longer resets the board, so this is cheap
+        if not arduino_open:
+            close_arduino()
+            if not connect_to_arduino():
+                return False
 
-    try:
-        arduino_serial.write(f"{command}\n".encode())
-        return True
-    except:
-        return False
+        try:
+            payload = _CMD_CACHE.get(command)
+            if payload is None:
+                payload = _CMD_CACHE[command] = (command + '\n').encode('ascii')
+            arduino_serial.write(payload)
+            arduino_serial.flush()  # Push it to the adapter now rather than on the next latency tick
+            arduino_open = True
+            return True
+        except (serial.SerialException, OSError):
+            arduino_open = False
+            return False
 
 
 def send_color_handshake(color_data):
     """Wait for UNO R4 to request color, then send it"""
-    global arduino_serial
-    if not arduino_serial:
-        print("✗ No Arduino connection")
-        return
-
-    print("Waiting for color request...")
-    start = time.time()
-    while time.time() - start < COLOR_REQUEST_TIMEOUT:
-        if arduino_serial.in_waiting:
-            line = arduino_serial.readline().decode().strip()
-            print(f"[UNO R4]: {line}")
-            if line == "REQ:COLOR":
-                arduino_serial.write(f"{color_data}\n".encode())
-                print(f"✓ Sent color: {color_data}")
-                return
-        time.sleep(0.05)
-    print("✗ Color request timeout")
+    global arduino_open
+    with arduino_lock:
+        if not arduino_serial:
+            log.error("✗ No Arduino connection")
+            return
+
+        log.info("Waiting for color request...")
+        deadline = time.time() + COLOR_REQUEST_TIMEOUT
+        pending = b''
+        # Runs on a background thread, so serial errors (e.g. board unplugged)
+        # have to be logged here rather than left to kill the thread
+        try:
+            while time.time() < deadline:
+                # Blocks until a line arrives or the short port timeout expires;
+                # keep partial reads until the rest of the line shows up
+                pending += arduino_serial.readline()
+                if not pending.endswith(b'\n'):
+                    continue
+                line = pending.decode(errors='replace').strip()
+                pending = b''
+                if not line:
+                    continue
+                log.info(f"[UNO R4]: {line}")
+                if line == "REQ:COLOR":
+                    # No flush(): tcdrain would block until the bytes leave, and the
+                    # kernel hands them off long before the LEDs need them
+                    arduino_serial.write(f"{color_data}\n".encode())
+                    arduino_open = True
+                    log.info(f"✓ Sent color: {color_data}")
+                    return
+        except (serial.SerialException, OSError) as e:
+            arduino_open = False
+            log.error(f"✗ Color handshake failed: {e}")
+            return
+        log.error("✗ Color request timeout")
+
+
+def send_color_in_background(color_data):
+    """Run the color handshake without delaying audio playback"""
+    threading.Thread(target=send_color_handshake, args=(color_data,), daemon=True).start()
+
+
+def play_memory(audio_path, color_data):
+    """Show the color on the UNO R4 and play the audio"""
+    # Runs on the executor, where nobody reads the Future, so log failures here
+    try:
+        # Trigger LED display alongside audio; the two are independent
+        if send_command_to_arduino("PLAY:START"):
+            send_color_in_background(color_data)
+        play_audio_on_laptop(audio_path)
+    except Exception as e:
+        log.error(f"✗ Playback error: {e}")
+
+
+def play_upload(upload_path, color_data):
+    """Play a queued upload, then delete its per-upload file"""
+    try:
+        play_memory(upload_path, color_data)
+    finally:
+        os.remove(upload_path)
+
+
+def publish_latest_audio(upload_path):
+    """Point audio.wav at the newest upload for /test-playback"""
+    link_path = upload_path + '.link'
+    try:
+        os.link(upload_path, link_path)
+    except OSError:
+        shutil.copyfile(upload_path, link_path)  # Filesystem without hardlinks
+    os.replace(link_path, AUDIO_PATH)
+
+
+@functools.lru_cache(maxsize=SOUND_CACHE_SIZE)
+def load_sound(path, mtime, size):
+    """Decode a clip once; mtime/size in the key drop entries for rewritten files"""
+    return pygame.mixer.Sound(path)
 
 
 def play_audio_on_laptop(audio_path):
     """Play audio file through laptop speakers"""
     try:
-        if not pygame.mixer.get_init():
-            pygame.mixer.init(frequency=SAMPLE_RATE, size=-16, channels=1)
+        if audio_path == AUDIO_PATH:
+            # /test-playback replays the same file, so keep it decoded
+            st = os.stat(audio_path)
+            sound = load_sound(audio_path, st.st_mtime_ns, st.st_size)
+        else:
+            # Uploads play once from a file deleted right after
+            sound = pygame.mixer.Sound(audio_path)
 
-        print(f"♫ Playing: {audio_path}")
-        pygame.mixer.music.load(str(audio_path))
-        pygame.mixer.music.play()
+        log.info(f"♫ Playing: {audio_path}")
+        pygame.mixer.Channel(PLAYBACK_CHANNEL).play(sound)
 
-        while pygame.mixer.music.get_busy():
-            time.sleep(0.1)
-        print("✓ Playback complete")
+        # SDL end events are only pumped on the main thread (macOS), so sleep
+        # out the clip's length instead of polling get_busy()
+        time.sleep(sound.get_length())
+        log.info("✓ Playback complete")
     except Exception as e:
-        print(f"✗ Audio error: {e}")
+        log.error(f"✗ Audio error: {e}")
 
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
     """Receive memory from ESP32 and play it back"""
     try:
-        print("\n" + "="*40)
-        print("RECEIVING MEMORY")
-        print("="*40)
+        log.info(f"\n{_BAR}\nRECEIVING MEMORY\n{_BAR}")
 
         # Get data from ESP32
         color_data = request.headers.get('X-Color-Data', DEFAULT_COLOR)
-        audio_data = request.get_data()
+        if not _COLOR_RE.fullmatch(color_data):
+            log.warning(f"⚠ Bad color {color_data!r}, using default: {DEFAULT_COLOR}")
+            color_data = DEFAULT_COLOR
+        chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
 
-        if not audio_data:
+        if not chunk:
             return jsonify({'status': 'error', 'message': 'No audio data'}), 400
 
-        # Save files
-        with open(UPLOAD_FOLDER / 'audio.wav', 'wb') as f:
-            f.write(audio_data)
-        with open(UPLOAD_FOLDER / 'color.dat', 'w') as f:
-            f.write(color_data)
-
-        print(f"Saved {len(audio_data)} bytes | Color: {color_data}")
+        # Save color first so a failure here can't strand an upload file
+        try:
+            with open(COLOR_PATH) as f:
+                old_color = f.read()
+        except FileNotFoundError:
+            old_color = None
+        if old_color != color_data:
+            # A few bytes, so skip the buffered/text file layers
+            fd = os.open(COLOR_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.write(fd, color_data.encode('ascii'))
+            finally:
+                os.close(fd)
+
+        # Save audio, streaming it to disk instead of buffering it in memory.
+        # Each upload gets its own file so a queued memory can't be overwritten
+        # by the next one before it plays
+        fd, upload_path = tempfile.mkstemp(dir=UPLOAD_FOLDER, prefix='upload-', suffix='.wav')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(chunk)
+                shutil.copyfileobj(request.stream, f, length=UPLOAD_CHUNK_SIZE)
+                total = f.tell()
+            publish_latest_audio(upload_path)
+        except BaseException:
+            os.remove(upload_path)
+            raise
 
-        # Trigger LED display
-        if send_command_to_arduino("PLAY:START"):
-            send_color_handshake(color_data)
+        log.info(f"Saved {total} bytes | Color: {color_data}")
 
-        # Play audio
-        play_audio_on_laptop(UPLOAD_FOLDER / 'audio.wav')
+        # Play it back off the request thread so the ESP32 isn't held for the whole clip
+        playback_executor.submit(play_upload, upload_path, color_data)
 
-        return jsonify({'status': 'success'}), 200
+        return jsonify({'status': 'accepted'}), 202
 
     except Exception as e:
-        print(f"✗ Error: {e}")
+        log.error(f"✗ Error: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
@@ -144,7 +353,7 @@ def upload_files():
 def status():
     return jsonify({
         'server': 'running',
-        'arduino': arduino_serial is not None and arduino_serial.is_open
+        'arduino': arduino_open
     })
 
 
@@ -152,52 +361,43 @@ def status():
 def test_playback():
     """Test playback using saved files from uploads/ folder"""
     try:
-        print("\n" + "="*40)
-        print("TEST PLAYBACK")
-        print("="*40)
-
-        # Load color data
-        color_file = UPLOAD_FOLDER / 'color.dat'
-        if color_file.exists():
-            with open(color_file, 'r') as f:
+        log.info(f"\n{_BAR}\nTEST PLAYBACK\n{_BAR}")
+
+        # Load color data (opening it doubles as the existence check)
+        try:
+            with open(COLOR_PATH, 'r') as f:
                 test_color = f.read().strip()
-            print(f"✓ Color: {test_color}")
-        else:
+            log.info(f"✓ Color: {test_color}")
+        except FileNotFoundError:
             test_color = "255,0,255"  # Purple
-            print(f"⚠ No color.dat, using purple: {test_color}")
+            log.warning(f"⚠ No color.dat, using purple: {test_color}")
 
         # Load audio file
-        test_audio = UPLOAD_FOLDER / 'audio.wav'
-        if not test_audio.exists():
-            print("⚠ No audio file, creating test audio...")
+        test_audio = AUDIO_PATH
+        try:
+            st = os.stat(test_audio)
+            log.info(f"✓ Audio: {test_audio} ({st.st_size} bytes)")
+        except FileNotFoundError:
+            log.warning("⚠ No audio file, creating test audio...")
             create_test_audio(test_audio)
-        else:
-            print(f"✓ Audio: {test_audio}")
 
-        # Trigger LED display
-        if send_command_to_arduino("PLAY:START"):
-            send_color_handshake(test_color)
-
-        # Play audio
-        play_audio_on_laptop(test_audio)
+        # Queue behind any uploaded memories instead of cutting them off
+        playback_executor.submit(play_memory, test_audio, test_color)
 
         return jsonify({
-            'status': 'success',
-            'message': 'Test complete',
+            'status': 'accepted',
+            'message': 'Test playback queued',
             'color': test_color,
-            'audio_file': str(test_audio)
-        }), 200
+            'audio_file': test_audio
+        }), 202
 
     except Exception as e:
-        print(f"✗ Test error: {e}")
+        log.error(f"✗ Test error: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
 def create_test_audio(filepath):
     """Create 1 second of silent test audio"""
-    import wave
-    import struct
-
     duration = 1  # seconds
     num_samples = SAMPLE_RATE * duration
 
@@ -205,17 +405,15 @@ def create_test_audio(filepath):
         wav_file.setnchannels(1)
         wav_file.setsampwidth(2)
         wav_file.setframerate(SAMPLE_RATE)
-        for _ in range(num_samples):
-            wav_file.writeframes(struct.pack('h', 0))
+        wav_file.writeframes(b'\x00' * (num_samples * 2))
 
-    print(f"✓ Created test audio: {filepath}")
+    log.info(f"✓ Created test audio: {filepath}")
 
 
 if __name__ == '__main__':
-    print("Starting Memory Bottle Server...")
-    pygame.mixer.init(frequency=SAMPLE_RATE, size=-16, channels=1)
+    log.info("Starting Memory Bottle Server...")
     connect_to_arduino()
-    app.run(host='0.0.0.0', port=8080, debug=True, use_reloader=False)
+    serve(app, host='0.0.0.0', port=8080, threads=4, channel_timeout=300)
 
 
 